@@ -1,17 +1,42 @@
-from flask import Flask, request, jsonify, send_from_directory, send_file
+# Patch blocking I/O before anything else is imported so requests and the
+# download worker cooperate as greenlets
+from gevent import monkey
+monkey.patch_all()
+
+import gevent
+from flask import Flask, request, jsonify, send_from_directory, send_file, make_response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from flask_compress import Compress
+import orjson
 import sqlite3
 import os
-import uuid
-from datetime import datetime, timedelta
 import threading
-import subprocess
 import time
-import json
 import re
+import mimetypes
+from urllib.parse import quote
+import collections
+import yt_dlp
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Serialize API responses with orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
-CORS(app)
+app.json = OrjsonProvider(app)
+CORS(app, expose_headers=['X-Total-Count'])
+
+# Compress JSON responses (the downloads list is highly repetitive)
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_LEVEL'] = 4
+app.config['COMPRESS_MIN_SIZE'] = 512
+Compress(app)
 
 DOWNLOAD_FOLDER = 'downloads'
 COOKIES_FILE = 'cookies.txt'
@@ -19,6 +44,56 @@ COOKIES_FILE = 'cookies.txt'
 # Chrome user-agent to match cookies
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36'
 
+# Options for the in-process yt-dlp instance used by the worker.
+# Files are named after the download id, which is injected into the info dict.
+YDL_OPTIONS = {
+    'format': 'b',  # Best single format (most compatible)
+    'outtmpl': os.path.join(DOWNLOAD_FOLDER, '%(download_id)s.%(ext)s'),
+    'noplaylist': True,
+    'quiet': True,
+    'no_warnings': True,
+    'cookiefile': COOKIES_FILE,
+    'http_headers': {'User-Agent': USER_AGENT},
+    'nocheckcertificate': True,
+    'retries': 3,
+    'fragment_retries': 3,
+}
+
+# Time limits for a single job, so a stalled video cannot hold a worker forever
+EXTRACT_TIMEOUT = 120  # seconds
+DOWNLOAD_TIMEOUT = 3600  # seconds
+
+# Let a front-end web server stream finished videos instead of the Flask worker:
+# 'X-Accel-Redirect' for nginx (internal location at SENDFILE_PREFIX aliased to
+# DOWNLOAD_FOLDER) or 'X-Sendfile' for Apache mod_xsendfile. Unset serves directly.
+SENDFILE_HEADER = os.environ.get('SENDFILE_HEADER')
+SENDFILE_PREFIX = os.environ.get('SENDFILE_PREFIX', '/protected/')
+app.config['USE_X_SENDFILE'] = SENDFILE_HEADER == 'X-Sendfile'
+
+# Average processing time is recomputed from the database at most every AVG_TIME_TTL seconds
+AVG_TIME_TTL = 30
+_avg_time_cache = {'value': 60.0, 'expires': 0.0}
+
+# Page size for GET /api/downloads (?limit=&offset=)
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Units and decimal places used by format_filesize
+FILESIZE_UNITS = ('B', 'KB', 'MB', 'GB')
+FILESIZE_DECIMALS = (0, 1, 1, 2)
+
+# Alphabet for ULID-style external ids (sortable by creation time)
+CROCKFORD_BASE32 = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+# Accepted YouTube URL forms: watch, shorts, embed and youtu.be links
+YOUTUBE_URL_RE = re.compile(
+    r'(?:https?://)?(?:www\.)?(?:youtube\.com/(?:watch\?v=|shorts/|embed/)|youtu\.be/)[\w-]+'
+)
+
+# Used to turn video titles into safe download filenames
+FILENAME_INVALID_RE = re.compile(r'[^\w\s-]')
+FILENAME_SEPARATOR_RE = re.compile(r'[-\s]+')
+
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
 
 # Create cookies file from environment variable if it exists
@@ -36,14 +111,57 @@ def setup_cookies():
 setup_cookies()
 
 # Worker state
-worker_thread = None
+worker_greenlets = []
 worker_running = False
 
-def init_db():
-    conn = sqlite3.connect('youtube_downloads.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS downloads
-                 (id TEXT PRIMARY KEY,
+# Number of downloads processed concurrently (at least one)
+DOWNLOAD_WORKERS = max(1, int(os.environ.get('DOWNLOAD_WORKERS', 2)))
+
+# Queued download ids; submit_download notifies job_cond so the workers never poll
+job_cond = threading.Condition()
+pending_jobs = collections.deque()
+
+# Old entries are cleaned up at most once per CLEANUP_INTERVAL seconds
+CLEANUP_INTERVAL = 3600
+_last_cleanup = float('-inf')
+
+# All writes go through one shared connection guarded by a lock, so writers queue
+# in-process instead of retrying on SQLITE_BUSY. Reads share one read-only
+# connection: requests and workers are greenlets on a single OS thread and
+# SQLite calls never yield, so queries cannot interleave on it.
+DB_PATH = 'youtube_downloads.db'
+_reader = None
+
+def _connect(database, **kwargs):
+    """Open a database connection with the settings shared by readers and the writer"""
+    conn = sqlite3.connect(database, check_same_thread=False, isolation_level=None, **kwargs)
+    conn.row_factory = sqlite3.Row
+    # Per-connection settings (journal_mode is persisted by init_db)
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=5000')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-20000')
+    return conn
+
+_writer = _connect(DB_PATH)
+_writer_lock = threading.Lock()
+
+def db_write(sql, params=()):
+    """Run an INSERT/UPDATE/DELETE on the writer connection and return any RETURNING rows"""
+    with _writer_lock:
+        # Fetch all rows so the statement finishes and commits before the lock is released
+        return _writer.execute(sql, params).fetchall()
+
+def get_db():
+    """Return the shared read-only database connection, opening it on first use"""
+    global _reader
+    if _reader is None:
+        _reader = _connect(f'file:{DB_PATH}?mode=ro', uri=True)
+    return _reader
+
+DOWNLOADS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS downloads
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  external_id TEXT UNIQUE NOT NULL,
                   url TEXT NOT NULL,
                   title TEXT,
                   filepath TEXT,
@@ -52,181 +170,172 @@ def init_db():
                   filesize TEXT,
                   status TEXT NOT NULL,
                   error TEXT,
-                  created_at TEXT NOT NULL,
-                  processed_at TEXT)''')
-    conn.commit()
-    conn.close()
+                  created_at INTEGER NOT NULL,
+                  processed_at INTEGER)'''
+
+def init_db():
+    # Runs at import, before any other thread can write
+    c = _writer.cursor()
+    
+    # Rebuild databases from older schemas: UUID primary keys become external ids
+    # and ISO timestamps (naive local time) become unix epoch seconds
+    columns = {r['name']: r['type'] for r in c.execute('PRAGMA table_info(downloads)')}
+    if columns and ('external_id' not in columns or columns['created_at'] != 'INTEGER'):
+        external_id = 'external_id' if 'external_id' in columns else 'id'
+        c.execute('BEGIN')
+        c.execute('ALTER TABLE downloads RENAME TO downloads_old')
+        c.execute(DOWNLOADS_TABLE_SQL)
+        c.execute(f'''INSERT INTO downloads
+                      (external_id, url, title, filepath, thumbnail, duration, filesize,
+                       status, error, created_at, processed_at)
+                      SELECT {external_id}, url, title, filepath, thumbnail, duration, filesize,
+                             status, error,
+                             CAST(strftime('%s', created_at, 'utc') AS INTEGER),
+                             CAST(strftime('%s', processed_at, 'utc') AS INTEGER)
+                      FROM downloads_old ORDER BY created_at''')
+        c.execute('DROP TABLE downloads_old')
+        c.execute('COMMIT')
+    
+    c.execute(DOWNLOADS_TABLE_SQL)
+    # Queue lookups filter on status and order by created_at; cleanup filters on created_at
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_downloads_status_created
+                 ON downloads(status, created_at)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_downloads_created
+                 ON downloads(created_at)''')
+    # WAL lets the API read while the worker writes
+    c.execute('PRAGMA journal_mode=WAL')
+
+init_db()
 
 def start_worker():
-    """Start the worker thread if not already running"""
-    global worker_thread, worker_running
+    """Start the worker greenlets if not already running"""
+    global worker_greenlets, worker_running
     
     if not worker_running:
+        # Queue downloads left over from a previous run
+        c = get_db().cursor()
+        c.execute('''SELECT id FROM downloads 
+                     WHERE status = 'not_started' 
+                     ORDER BY created_at ASC, id ASC''')
+        with job_cond:
+            pending_jobs.extend(row['id'] for row in c.fetchall())
+        
         worker_running = True
-        worker_thread = threading.Thread(target=worker_loop, daemon=True)
-        worker_thread.start()
-        print("✅ Worker thread started")
+        worker_greenlets = [gevent.spawn(worker_loop) for _ in range(DOWNLOAD_WORKERS)]
+        print(f"✅ Started {DOWNLOAD_WORKERS} download worker(s)")
 
 def cleanup_old_entries():
-    """Delete database entries and video files older than 10 days"""
+    """Delete database entries and video files older than 10 days, at most once per hour"""
+    global _last_cleanup
+    if time.monotonic() - _last_cleanup < CLEANUP_INTERVAL:
+        return
+    _last_cleanup = time.monotonic()
+    
     try:
-        conn = sqlite3.connect('youtube_downloads.db')
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        
         # Calculate cutoff date (10 days ago)
-        cutoff_date = (datetime.now() - timedelta(days=10)).isoformat()
+        cutoff_date = int(time.time()) - 10 * 86400
         
-        # First, get all old entries to delete their video files
-        c.execute('''SELECT id, filepath FROM downloads 
-                     WHERE created_at < ?''', (cutoff_date,))
-        old_entries = c.fetchall()
+        # Delete old database entries, getting their video files back in the same pass
+        old_entries = db_write('''DELETE FROM downloads WHERE created_at < ?
+                                  RETURNING filepath''', (cutoff_date,))
         
         if old_entries:
             deleted_files = 0
-            deleted_rows = 0
+            deleted_rows = len(old_entries)
             
             for entry in old_entries:
                 # Delete the video file if it exists
                 filepath = entry['filepath']
-                if filepath and os.path.exists(filepath):
-                    try:
-                        os.remove(filepath)
-                        deleted_files += 1
-                    except Exception as e:
-                        print(f"⚠️  Failed to delete old video file {filepath}: {e}")
-            
-            # Delete old database entries
-            c.execute('''DELETE FROM downloads WHERE created_at < ?''', (cutoff_date,))
-            deleted_rows = c.rowcount
-            conn.commit()
+                if not filepath:
+                    continue
+                try:
+                    os.remove(filepath)
+                    deleted_files += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"⚠️  Failed to delete old video file {filepath}: {e}")
             
-            if deleted_rows > 0 or deleted_files > 0:
-                print(f"🧹 Cleanup: Deleted {deleted_rows} old entries and {deleted_files} video files (older than 10 days)")
-        
-        conn.close()
+            print(f"🧹 Cleanup: Deleted {deleted_rows} old entries and {deleted_files} video files (older than 10 days)")
     except Exception as e:
         print(f"⚠️  Cleanup error: {e}")
 
-def extract_video_info(url):
-    """Extract video info using yt-dlp without downloading"""
+def extract_video_info(ydl, url):
+    """Extract video info using yt-dlp without downloading and return it with any error"""
     try:
-        command = [
-            'yt-dlp',
-            '--dump-json',
-            '--no-download',
-            '--no-warnings',
-            '--cookies', COOKIES_FILE,
-            '--user-agent', USER_AGENT,
-            '--no-check-certificates',
-            url
-        ]
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            timeout=120
-        )
-        
-        if result.returncode == 0:
-            info = json.loads(result.stdout)
-            return {
-                'title': info.get('title', 'Unknown'),
-                'duration': info.get('duration_string', info.get('duration', '')),
-                'thumbnail': info.get('thumbnail', ''),
-            }
-        else:
-            print(f"⚠️  yt-dlp info error: {result.stderr}")
+        with gevent.Timeout(EXTRACT_TIMEOUT, TimeoutError(f"Video info extraction timed out after {EXTRACT_TIMEOUT} seconds")):
+            return ydl.extract_info(url, download=False), None
     except Exception as e:
+        # Keep yt-dlp's message (bot check, private video, ...) for the stored error
         print(f"⚠️  Failed to extract video info: {e}")
-    
-    return None
+        return None, str(e)
 
 def worker_loop():
     """Main worker loop that downloads YouTube videos"""
     print("🤖 YouTube Downloader Worker started. Monitoring for new downloads...")
     
-    POLL_INTERVAL = 3  # seconds
+    IDLE_TIMEOUT = 60  # seconds, wake up for cleanup even when no jobs arrive
+    ERROR_BACKOFF = 3  # seconds
+    
+    # One yt-dlp instance for the lifetime of the worker (instances are not shared)
+    ydl = yt_dlp.YoutubeDL(YDL_OPTIONS)
     
     while worker_running:
-        # Run cleanup before processing each task
+        # Run cleanup if it is due
         cleanup_old_entries()
         try:
-            # Get next unprocessed download
-            conn = sqlite3.connect('youtube_downloads.db')
-            conn.row_factory = sqlite3.Row
-            c = conn.cursor()
-            c.execute('''SELECT * FROM downloads 
-                         WHERE status = 'not_started' 
-                         ORDER BY created_at ASC 
-                         LIMIT 1''')
-            row = c.fetchone()
-            conn.close()
+            # Wait for the next queued download
+            with job_cond:
+                if not pending_jobs:
+                    job_cond.wait(timeout=IDLE_TIMEOUT)
+                download_id = pending_jobs.popleft() if pending_jobs else None
+            
+            row = None
+            if download_id:
+                # Claim the download and mark it as processing in one statement,
+                # so ids queued twice are never picked up by two workers
+                claimed = db_write('''UPDATE downloads SET status = 'processing' 
+                                      WHERE id = ? AND status = 'not_started' 
+                                      RETURNING id, external_id, url''', (download_id,))
+                row = claimed[0] if claimed else None
             
             if row:
                 download_id = row['id']
+                external_id = row['external_id']
                 url = row['url']
                 
                 print(f"\n{'='*60}")
-                print(f"📥 Processing download: {download_id}")
+                print(f"📥 Processing download: {external_id}")
                 print(f"🔗 URL: {url}")
                 print(f"{'='*60}")
                 
-                # Update status to processing
-                update_status(download_id, 'processing')
+                # Video info and result are written together once the job ends
+                title = duration = thumbnail = None
+                downloaded_file = filesize_str = error = None
                 
                 try:
                     # First, get video info
                     print(f"🔍 Extracting video info...")
-                    info = extract_video_info(url)
+                    info, error = extract_video_info(ydl, url)
                     
-                    if info:
-                        # Update with video info
-                        conn = sqlite3.connect('youtube_downloads.db')
-                        c = conn.cursor()
-                        c.execute('''UPDATE downloads 
-                                     SET title = ?, duration = ?, thumbnail = ?
-                                     WHERE id = ?''',
-                                  (info['title'], str(info['duration']), info['thumbnail'], download_id))
-                        conn.commit()
-                        conn.close()
-                        print(f"📹 Title: {info['title']}")
+                    if not info:
+                        raise Exception(error or "Failed to extract video info")
                     
-                    # Download video
-                    output_template = os.path.join(DOWNLOAD_FOLDER, f"{download_id}.%(ext)s")
+                    title = info.get('title', 'Unknown')
+                    duration = str(info.get('duration_string', info.get('duration', '')))
+                    thumbnail = info.get('thumbnail', '')
+                    print(f"📹 Title: {title}")
                     
+                    # Download video, reusing the extracted info so yt-dlp
+                    # does not resolve the video a second time
                     print(f"🔄 Downloading video...")
-                    command = [
-                        'yt-dlp',
-                        '-f', 'b',  # Best single format (most compatible)
-                        '-o', output_template,
-                        '--no-playlist',
-                        '--no-warnings',
-                        '--cookies', COOKIES_FILE,
-                        '--user-agent', USER_AGENT,
-                        '--no-check-certificates',
-                        '--retries', '3',
-                        '--fragment-retries', '3',
-                        url
-                    ]
-                    
-                    result = subprocess.run(
-                        command,
-                        capture_output=True,
-                        text=True,
-                        timeout=3600  # 1 hour timeout
-                    )
-                    
-                    if result.returncode != 0:
-                        raise Exception(f"yt-dlp error: {result.stderr}")
+                    info['download_id'] = external_id
+                    with gevent.Timeout(DOWNLOAD_TIMEOUT, TimeoutError("Download timed out after 1 hour")):
+                        result = ydl.process_ie_result(info, download=True)
                     
-                    # Find the downloaded file
-                    downloaded_file = None
-                    for ext in ['mp4', 'webm', 'mkv', 'avi']:
-                        potential_file = os.path.join(DOWNLOAD_FOLDER, f"{download_id}.{ext}")
-                        if os.path.exists(potential_file):
-                            downloaded_file = potential_file
-                            break
+                    # yt-dlp reports where it saved the file
+                    requested = result.get('requested_downloads') or [{}]
+                    downloaded_file = requested[0].get('filepath')
                     
                     if not downloaded_file:
                         raise Exception("Downloaded file not found")
@@ -237,70 +346,51 @@ def worker_loop():
                     
                     print(f"✅ Successfully downloaded: {downloaded_file}")
                     print(f"📦 Size: {filesize_str}")
-                    
-                    # Update database with success
-                    conn = sqlite3.connect('youtube_downloads.db')
-                    c = conn.cursor()
-                    c.execute('''UPDATE downloads 
-                                 SET status = ?, filepath = ?, filesize = ?, processed_at = ?
-                                 WHERE id = ?''',
-                              ('completed', downloaded_file, filesize_str, datetime.now().isoformat(), download_id))
-                    conn.commit()
-                    conn.close()
+                    status = 'completed'
                     
                 except Exception as e:
                     print(f"❌ Failed to download: {url}")
                     print(f"Error: {str(e)}")
-                    update_status(download_id, 'failed', error=str(e))
-                    
-            else:
-                # No downloads to process, sleep for a bit
-                time.sleep(POLL_INTERVAL)
+                    status = 'failed'
+                    error = str(e)
+                    downloaded_file = filesize_str = None
+                
+                # Update database with the outcome in a single write
+                db_write('''UPDATE downloads 
+                            SET status = ?, title = ?, duration = ?, thumbnail = ?,
+                                filepath = ?, filesize = ?, error = ?, processed_at = ?
+                            WHERE id = ?''',
+                         (status, title, duration, thumbnail,
+                          downloaded_file, filesize_str, error, int(time.time()), download_id))
+                
+                if status == 'completed':
+                    # Let the next request recompute the average with this job included
+                    _avg_time_cache['expires'] = 0.0
                 
         except Exception as e:
             print(f"⚠️  Worker error: {str(e)}")
-            time.sleep(POLL_INTERVAL)
+            time.sleep(ERROR_BACKOFF)
 
 def format_filesize(size_bytes):
     """Format file size in human readable format"""
-    if size_bytes < 1024:
+    # Each unit is 2**10 of the previous one, so the bit length picks the unit
+    i = min(max(0, (size_bytes.bit_length() - 1) // 10), len(FILESIZE_UNITS) - 1)
+    if not i:
         return f"{size_bytes} B"
-    elif size_bytes < 1024 * 1024:
-        return f"{size_bytes / 1024:.1f} KB"
-    elif size_bytes < 1024 * 1024 * 1024:
-        return f"{size_bytes / (1024 * 1024):.1f} MB"
-    else:
-        return f"{size_bytes / (1024 * 1024 * 1024):.2f} GB"
-
-def update_status(download_id, status, error=None):
-    """Update the status of a download in the database"""
-    conn = sqlite3.connect('youtube_downloads.db')
-    c = conn.cursor()
-    
-    if status == 'failed':
-        c.execute('''UPDATE downloads 
-                     SET status = ?, error = ?, processed_at = ?
-                     WHERE id = ?''',
-                  (status, error, datetime.now().isoformat(), download_id))
-    else:
-        c.execute('UPDATE downloads SET status = ? WHERE id = ?', (status, download_id))
-    
-    conn.commit()
-    conn.close()
+    return f"{size_bytes / (1 << (10 * i)):.{FILESIZE_DECIMALS[i]}f} {FILESIZE_UNITS[i]}"
+
+def new_external_id():
+    """Generate a ULID: 48-bit millisecond timestamp + 80 random bits in Crockford base32"""
+    value = (int(time.time() * 1000) << 80) | int.from_bytes(os.urandom(10), 'big')
+    chars = []
+    for _ in range(26):
+        chars.append(CROCKFORD_BASE32[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
 
 def is_valid_youtube_url(url):
     """Validate YouTube URL"""
-    youtube_patterns = [
-        r'(https?://)?(www\.)?youtube\.com/watch\?v=[\w-]+',
-        r'(https?://)?(www\.)?youtube\.com/shorts/[\w-]+',
-        r'(https?://)?(www\.)?youtu\.be/[\w-]+',
-        r'(https?://)?(www\.)?youtube\.com/embed/[\w-]+',
-    ]
-    
-    for pattern in youtube_patterns:
-        if re.match(pattern, url):
-            return True
-    return False
+    return YOUTUBE_URL_RE.match(url) is not None
 
 @app.route('/')
 def index():
@@ -321,22 +411,25 @@ def submit_download():
     if not is_valid_youtube_url(url):
         return jsonify({'error': 'Invalid YouTube URL'}), 400
     
-    download_id = str(uuid.uuid4())
+    external_id = new_external_id()
     
-    conn = sqlite3.connect('youtube_downloads.db')
-    c = conn.cursor()
-    c.execute('''INSERT INTO downloads 
-                 (id, url, status, created_at)
-                 VALUES (?, ?, ?, ?)''',
-              (download_id, url, 'not_started', datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
+    inserted = db_write('''INSERT INTO downloads 
+                           (external_id, url, status, created_at)
+                           VALUES (?, ?, ?, ?)
+                           RETURNING id''',
+                        (external_id, url, 'not_started', int(time.time())))
+    download_id = inserted[0]['id']
     
     # Start worker on first download
     start_worker()
     
+    # Wake the worker
+    with job_cond:
+        pending_jobs.append(download_id)
+        job_cond.notify()
+    
     return jsonify({
-        'id': download_id,
+        'id': external_id,
         'url': url,
         'status': 'not_started',
         'message': 'Download queued successfully'
@@ -344,66 +437,69 @@ def submit_download():
 
 def get_average_processing_time(cursor):
     """Calculate average processing time from completed downloads in seconds"""
+    if time.monotonic() < _avg_time_cache['expires']:
+        return _avg_time_cache['value']
+    
     cursor.execute('''SELECT created_at, processed_at FROM downloads 
                       WHERE status = 'completed' AND processed_at IS NOT NULL
                       ORDER BY processed_at DESC LIMIT 20''')
     completed_rows = cursor.fetchall()
     
-    if not completed_rows:
-        return 60.0  # Default estimate: 60 seconds per download
-    
     total_seconds = 0
     count = 0
     for r in completed_rows:
-        try:
-            created = datetime.fromisoformat(r['created_at'])
-            processed = datetime.fromisoformat(r['processed_at'])
-            duration = (processed - created).total_seconds()
-            if duration > 0:
-                total_seconds += duration
-                count += 1
-        except:
-            continue
-    
-    return total_seconds / count if count > 0 else 60.0
+        duration = r['processed_at'] - r['created_at']
+        if duration > 0:
+            total_seconds += duration
+            count += 1
+    
+    # Default estimate: 60 seconds per download
+    _avg_time_cache['value'] = total_seconds / count if count > 0 else 60.0
+    _avg_time_cache['expires'] = time.monotonic() + AVG_TIME_TTL
+    return _avg_time_cache['value']
 
 @app.route('/api/downloads', methods=['GET'])
 def get_downloads():
-    conn = sqlite3.connect('youtube_downloads.db')
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
+    c = get_db().cursor()
     
     # Get average processing time
     avg_time = get_average_processing_time(c)
     
-    # Get queue (downloads waiting to be processed, ordered by creation time)
-    c.execute('''SELECT id FROM downloads 
-                 WHERE status = 'not_started' 
-                 ORDER BY created_at ASC''')
-    queue_ids = [row['id'] for row in c.fetchall()]
-    
     # Check if there's a download currently processing
     c.execute('''SELECT COUNT(*) as count FROM downloads WHERE status = 'processing' ''')
     processing_count = c.fetchone()['count']
     
-    c.execute('SELECT * FROM downloads ORDER BY created_at DESC')
+    # Total number of downloads, so clients know whether more pages exist
+    c.execute('SELECT COUNT(*) as count FROM downloads')
+    total_count = c.fetchone()['count']
+    
+    # Page of downloads, newest first, with queue positions (1-based) computed in SQL
+    limit = max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    c.execute('''WITH queue AS (
+                     SELECT id, ROW_NUMBER() OVER (ORDER BY created_at, id) AS position
+                     FROM downloads 
+                     WHERE status = 'not_started'
+                 )
+                 SELECT d.*, queue.position AS queue_position
+                 FROM downloads d LEFT JOIN queue USING (id)
+                 ORDER BY d.created_at DESC, d.id DESC
+                 LIMIT ? OFFSET ?''', (limit, offset))
     rows = c.fetchall()
-    conn.close()
     
     downloads = []
     for row in rows:
-        # Calculate queue position (1-based) for downloads in queue
-        queue_position = None
+        # Estimate start time for downloads in queue
+        queue_position = row['queue_position']
         estimated_start_seconds = None
         
-        if row['status'] == 'not_started' and row['id'] in queue_ids:
-            queue_position = queue_ids.index(row['id']) + 1
+        if queue_position is not None:
             # Estimate = (downloads ahead + currently processing) * avg time
             downloads_ahead = queue_position - 1 + processing_count
-            estimated_start_seconds = round(downloads_ahead * avg_time)
+            estimated_start_seconds = round(downloads_ahead // DOWNLOAD_WORKERS * avg_time)
         
         downloads.append({
-            'id': row['id'],
+            'id': row['external_id'],
             'url': row['url'],
             'title': row['title'],
             'filepath': row['filepath'],
@@ -418,18 +514,17 @@ def get_downloads():
             'estimated_start_seconds': estimated_start_seconds
         })
     
-    return jsonify(downloads)
+    response = jsonify(downloads)
+    response.headers['X-Total-Count'] = str(total_count)
+    return response
 
 @app.route('/api/downloads/<download_id>', methods=['GET'])
 def get_download(download_id):
-    conn = sqlite3.connect('youtube_downloads.db')
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('SELECT * FROM downloads WHERE id = ?', (download_id,))
+    c = get_db().cursor()
+    c.execute('SELECT * FROM downloads WHERE external_id = ?', (download_id,))
     row = c.fetchone()
     
     if row is None:
-        conn.close()
         return jsonify({'error': 'Download not found'}), 404
     
     # Calculate queue position and estimated time if download is waiting
@@ -442,8 +537,8 @@ def get_download(download_id):
         
         # Count downloads ahead in queue
         c.execute('''SELECT COUNT(*) as position FROM downloads 
-                     WHERE status = 'not_started' AND created_at < ?''',
-                  (row['created_at'],))
+                     WHERE status = 'not_started' AND (created_at, id) < (?, ?)''',
+                  (row['created_at'], row['id']))
         position_row = c.fetchone()
         queue_position = position_row['position'] + 1  # 1-based position
         
@@ -453,12 +548,10 @@ def get_download(download_id):
         
         # Estimate = (downloads ahead + currently processing) * avg time
         downloads_ahead = queue_position - 1 + processing_count
-        estimated_start_seconds = round(downloads_ahead * avg_time)
-    
-    conn.close()
+        estimated_start_seconds = round(downloads_ahead // DOWNLOAD_WORKERS * avg_time)
     
     return jsonify({
-        'id': row['id'],
+        'id': row['external_id'],
         'url': row['url'],
         'title': row['title'],
         'filepath': row['filepath'],
@@ -475,12 +568,9 @@ def get_download(download_id):
 
 @app.route('/api/downloads/<download_id>/video', methods=['GET'])
 def download_video(download_id):
-    conn = sqlite3.connect('youtube_downloads.db')
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('SELECT * FROM downloads WHERE id = ?', (download_id,))
+    c = get_db().cursor()
+    c.execute('SELECT * FROM downloads WHERE external_id = ?', (download_id,))
     row = c.fetchone()
-    conn.close()
     
     if row is None:
         return jsonify({'error': 'Download not found'}), 404
@@ -489,34 +579,49 @@ def download_video(download_id):
         return jsonify({'error': 'Video not ready yet'}), 400
     
     filepath = row['filepath']
-    if not filepath or not os.path.exists(filepath):
+    if not filepath:
         return jsonify({'error': 'Video file not found'}), 404
     
     # Get filename for download
     title = row['title'] or 'video'
     # Clean filename
-    safe_title = re.sub(r'[^\w\s-]', '', title).strip()
-    safe_title = re.sub(r'[-\s]+', '-', safe_title)
+    safe_title = FILENAME_INVALID_RE.sub('', title).strip()
+    safe_title = FILENAME_SEPARATOR_RE.sub('-', safe_title)
     
     ext = os.path.splitext(filepath)[1]
     download_name = f"{safe_title}{ext}"
     
-    return send_file(
-        filepath,
-        as_attachment=True,
-        download_name=download_name
-    )
+    if SENDFILE_HEADER == 'X-Accel-Redirect':
+        response = make_response('')
+        response.mimetype = mimetypes.guess_type(filepath)[0] or 'application/octet-stream'
+        response.headers['X-Accel-Redirect'] = f"{SENDFILE_PREFIX}{os.path.basename(filepath)}"
+        try:
+            download_name.encode('ascii')
+            response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+        except UnicodeEncodeError:
+            response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(download_name)}"
+        return response
+    
+    # send_file stats the file itself, so a missing file shows up here
+    try:
+        return send_file(
+            filepath,
+            as_attachment=True,
+            download_name=download_name
+        )
+    except FileNotFoundError:
+        return jsonify({'error': 'Video file not found'}), 404
 
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({
         'status': 'healthy',
         'service': 'youtube-downloader',
-        'worker_running': worker_running
+        'worker_running': worker_running,
+        'download_workers': DOWNLOAD_WORKERS
     })
 
 if __name__ == '__main__':
-    init_db()
     print("\n" + "="*60)
     print("🚀 YouTube Downloader API Server")
     print("="*60)
@@ -1,99 +1,90 @@
+# Patch blocking I/O so gevent timeouts can interrupt a stalled yt-dlp call
+from gevent import monkey
+monkey.patch_all()
+
+import gevent
 import sqlite3
 import time
 import os
-import subprocess
-import json
-from datetime import datetime, timedelta
+import yt_dlp
 
 DOWNLOAD_FOLDER = 'downloads'
 COOKIES_FILE = 'cookies.txt'
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36'
 POLL_INTERVAL = 3  # seconds
+DB_PATH = 'youtube_downloads.db'
+CLEANUP_INTERVAL = 3600  # seconds
+EXTRACT_TIMEOUT = 120  # seconds
+DOWNLOAD_TIMEOUT = 3600  # seconds
+
+# Options for the in-process yt-dlp instance used by the worker.
+# Files are named after the download id, which is injected into the info dict.
+YDL_OPTIONS = {
+    'format': 'b',  # Best single format (most compatible)
+    'outtmpl': os.path.join(DOWNLOAD_FOLDER, '%(download_id)s.%(ext)s'),
+    'noplaylist': True,
+    'quiet': True,
+    'no_warnings': True,
+    'cookiefile': COOKIES_FILE,
+    'http_headers': {'User-Agent': USER_AGENT},
+    'nocheckcertificate': True,
+    'retries': 3,
+    'fragment_retries': 3,
+}
+
+# Units and decimal places used by format_filesize
+FILESIZE_UNITS = ('B', 'KB', 'MB', 'GB')
+FILESIZE_DECIMALS = (0, 1, 1, 2)
+
+_last_cleanup = float('-inf')
+
+# Single long-lived connection for the standalone worker
+_db_conn = None
+
+def get_db():
+    """Return the worker's database connection, opening it on first use"""
+    global _db_conn
+    if _db_conn is None:
+        _db_conn = sqlite3.connect(DB_PATH, isolation_level=None)
+        _db_conn.row_factory = sqlite3.Row
+        _db_conn.execute('PRAGMA journal_mode=WAL')
+        _db_conn.execute('PRAGMA synchronous=NORMAL')
+        _db_conn.execute('PRAGMA busy_timeout=5000')
+        _db_conn.execute('PRAGMA temp_store=MEMORY')
+        _db_conn.execute('PRAGMA cache_size=-20000')
+    return _db_conn
 
 def format_filesize(size_bytes):
     """Format file size in human readable format"""
-    if size_bytes < 1024:
+    # Each unit is 2**10 of the previous one, so the bit length picks the unit
+    i = min(max(0, (size_bytes.bit_length() - 1) // 10), len(FILESIZE_UNITS) - 1)
+    if not i:
         return f"{size_bytes} B"
-    elif size_bytes < 1024 * 1024:
-        return f"{size_bytes / 1024:.1f} KB"
-    elif size_bytes < 1024 * 1024 * 1024:
-        return f"{size_bytes / (1024 * 1024):.1f} MB"
-    else:
-        return f"{size_bytes / (1024 * 1024 * 1024):.2f} GB"
+    return f"{size_bytes / (1 << (10 * i)):.{FILESIZE_DECIMALS[i]}f} {FILESIZE_UNITS[i]}"
 
-def extract_video_info(url):
-    """Extract video info using yt-dlp without downloading"""
+def extract_video_info(ydl, url):
+    """Extract video info using yt-dlp without downloading and return it with any error"""
     try:
-        command = [
-            'yt-dlp',
-            '--dump-json',
-            '--no-download',
-            '--no-warnings',
-            '--cookies', COOKIES_FILE,
-            '--user-agent', USER_AGENT,
-            '--no-check-certificates',
-            url
-        ]
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            timeout=120
-        )
-        
-        if result.returncode == 0:
-            info = json.loads(result.stdout)
-            return {
-                'title': info.get('title', 'Unknown'),
-                'duration': info.get('duration_string', info.get('duration', '')),
-                'thumbnail': info.get('thumbnail', ''),
-            }
-        else:
-            print(f"⚠️  yt-dlp info error: {result.stderr}")
+        with gevent.Timeout(EXTRACT_TIMEOUT, TimeoutError(f"Video info extraction timed out after {EXTRACT_TIMEOUT} seconds")):
+            return ydl.extract_info(url, download=False), None
     except Exception as e:
+        # Keep yt-dlp's message (bot check, private video, ...) for the stored error
         print(f"⚠️  Failed to extract video info: {e}")
-    
-    return None
+        return None, str(e)
 
-def download_video(download_id, url):
-    """Download video using yt-dlp and return the result"""
+def download_video(ydl, external_id, info):
+    """Download video using the already extracted info and return the result"""
     try:
-        print(f"🔄 Downloading video from: {url}")
-        
-        # Download video
-        output_template = os.path.join(DOWNLOAD_FOLDER, f"{download_id}.%(ext)s")
-        
-        command = [
-            'yt-dlp',
-            '-f', 'b',  # Best single format (most compatible)
-            '-o', output_template,
-            '--no-playlist',
-            '--no-warnings',
-            '--cookies', COOKIES_FILE,
-            '--user-agent', USER_AGENT,
-            '--no-check-certificates',
-            '--retries', '3',
-            '--fragment-retries', '3',
-            url
-        ]
-        
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            timeout=3600  # 1 hour timeout
-        )
+        print(f"🔄 Downloading video from: {info.get('webpage_url')}")
         
-        if result.returncode != 0:
-            return None, f"yt-dlp error: {result.stderr}"
+        # Reuse the extracted info so yt-dlp does not resolve the video again
+        info['download_id'] = external_id
+        with gevent.Timeout(DOWNLOAD_TIMEOUT, TimeoutError("Download timed out after 1 hour")):
+            result = ydl.process_ie_result(info, download=True)
         
-        # Find the downloaded file
-        downloaded_file = None
-        for ext in ['mp4', 'webm', 'mkv', 'avi']:
-            potential_file = os.path.join(DOWNLOAD_FOLDER, f"{download_id}.{ext}")
-            if os.path.exists(potential_file):
-                downloaded_file = potential_file
-                break
+        # yt-dlp reports where it saved the file
+        requested = result.get('requested_downloads') or [{}]
+        downloaded_file = requested[0].get('filepath')
         
         if not downloaded_file:
             return None, "Downloaded file not found"
@@ -107,66 +98,51 @@ def download_video(download_id, url):
             'filesize': filesize_str
         }, None
         
-    except subprocess.TimeoutExpired:
-        return None, "Download timed out after 1 hour"
     except Exception as e:
         print(f"❌ Error downloading video: {str(e)}")
         return None, str(e)
 
-def update_status(download_id, status, error=None):
+def update_status(download_id, status):
     """Update the status of a download in the database"""
-    conn = sqlite3.connect('youtube_downloads.db')
-    c = conn.cursor()
-    
-    if status == 'failed':
-        c.execute('''UPDATE downloads 
-                     SET status = ?, error = ?, processed_at = ?
-                     WHERE id = ?''',
-                  (status, error, datetime.now().isoformat(), download_id))
-    else:
-        c.execute('UPDATE downloads SET status = ? WHERE id = ?', (status, download_id))
-    
-    conn.commit()
-    conn.close()
+    c = get_db().cursor()
+    c.execute('UPDATE downloads SET status = ? WHERE id = ?', (status, download_id))
 
 def cleanup_old_entries():
-    """Delete database entries and video files older than 10 days"""
+    """Delete database entries and video files older than 10 days, at most once per hour"""
+    global _last_cleanup
+    if time.monotonic() - _last_cleanup < CLEANUP_INTERVAL:
+        return
+    _last_cleanup = time.monotonic()
+    
     try:
-        conn = sqlite3.connect('youtube_downloads.db')
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
+        c = get_db().cursor()
         
         # Calculate cutoff date (10 days ago)
-        cutoff_date = (datetime.now() - timedelta(days=10)).isoformat()
+        cutoff_date = int(time.time()) - 10 * 86400
         
-        # First, get all old entries to delete their video files
-        c.execute('''SELECT id, filepath FROM downloads 
-                     WHERE created_at < ?''', (cutoff_date,))
+        # Delete old database entries, getting their video files back in the same pass
+        c.execute('''DELETE FROM downloads WHERE created_at < ?
+                     RETURNING filepath''', (cutoff_date,))
         old_entries = c.fetchall()
         
         if old_entries:
             deleted_files = 0
-            deleted_rows = 0
+            deleted_rows = len(old_entries)
             
             for entry in old_entries:
                 # Delete the video file if it exists
                 filepath = entry['filepath']
-                if filepath and os.path.exists(filepath):
-                    try:
-                        os.remove(filepath)
-                        deleted_files += 1
-                    except Exception as e:
-                        print(f"⚠️  Failed to delete old video file {filepath}: {e}")
-            
-            # Delete old database entries
-            c.execute('''DELETE FROM downloads WHERE created_at < ?''', (cutoff_date,))
-            deleted_rows = c.rowcount
-            conn.commit()
+                if not filepath:
+                    continue
+                try:
+                    os.remove(filepath)
+                    deleted_files += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"⚠️  Failed to delete old video file {filepath}: {e}")
             
-            if deleted_rows > 0 or deleted_files > 0:
-                print(f"🧹 Cleanup: Deleted {deleted_rows} old entries and {deleted_files} video files (older than 10 days)")
-        
-        conn.close()
+            print(f"🧹 Cleanup: Deleted {deleted_rows} old entries and {deleted_files} video files (older than 10 days)")
     except Exception as e:
         print(f"⚠️  Cleanup error: {e}")
 
@@ -175,27 +151,28 @@ def worker_loop():
     print("🤖 YouTube Downloader Worker started. Monitoring for new downloads...")
     print("🗑️  Video files older than 10 days will be auto-deleted\n")
     
+    # One yt-dlp instance for the lifetime of the worker
+    ydl = yt_dlp.YoutubeDL(YDL_OPTIONS)
+    
     while True:
-        # Run cleanup before processing each task
+        # Run cleanup if it is due
         cleanup_old_entries()
         try:
             # Get next unprocessed download
-            conn = sqlite3.connect('youtube_downloads.db')
-            conn.row_factory = sqlite3.Row
-            c = conn.cursor()
-            c.execute('''SELECT * FROM downloads 
+            c = get_db().cursor()
+            c.execute('''SELECT id, external_id, url FROM downloads 
                          WHERE status = 'not_started' 
-                         ORDER BY created_at ASC 
+                         ORDER BY created_at ASC, id ASC 
                          LIMIT 1''')
             row = c.fetchone()
-            conn.close()
             
             if row:
                 download_id = row['id']
+                external_id = row['external_id']
                 url = row['url']
                 
                 print(f"\n{'='*60}")
-                print(f"📥 Processing download: {download_id}")
+                print(f"📥 Processing download: {external_id}")
                 print(f"🔗 URL: {url}")
                 print(f"{'='*60}")
                 
@@ -204,40 +181,38 @@ def worker_loop():
                 
                 # First, get video info
                 print(f"🔍 Extracting video info...")
-                info = extract_video_info(url)
+                info, error = extract_video_info(ydl, url)
                 
+                title = duration = thumbnail = None
                 if info:
-                    # Update with video info
-                    conn = sqlite3.connect('youtube_downloads.db')
-                    c = conn.cursor()
-                    c.execute('''UPDATE downloads 
-                                 SET title = ?, duration = ?, thumbnail = ?
-                                 WHERE id = ?''',
-                              (info['title'], str(info['duration']), info['thumbnail'], download_id))
-                    conn.commit()
-                    conn.close()
-                    print(f"📹 Title: {info['title']}")
-                
-                # Download the video
-                result, error = download_video(download_id, url)
+                    title = info.get('title', 'Unknown')
+                    duration = str(info.get('duration_string', info.get('duration', '')))
+                    thumbnail = info.get('thumbnail', '')
+                    print(f"📹 Title: {title}")
+                    
+                    # Download the video
+                    result, error = download_video(ydl, external_id, info)
+                else:
+                    result, error = None, error or "Failed to extract video info"
                 
                 if result:
                     print(f"✅ Successfully downloaded!")
                     print(f"📦 Size: {result['filesize']}")
-                    
-                    # Update database with success
-                    conn = sqlite3.connect('youtube_downloads.db')
-                    c = conn.cursor()
-                    c.execute('''UPDATE downloads 
-                                 SET status = ?, filepath = ?, filesize = ?, processed_at = ?
-                                 WHERE id = ?''',
-                              ('completed', result['filepath'], result['filesize'], datetime.now().isoformat(), download_id))
-                    conn.commit()
-                    conn.close()
+                    status = 'completed'
                 else:
                     print(f"❌ Failed to download: {url}")
                     print(f"Error: {error}")
-                    update_status(download_id, 'failed', error=error)
+                    status = 'failed'
+                    result = {'filepath': None, 'filesize': None}
+                
+                # Update database with the outcome and video info in a single write
+                c = get_db().cursor()
+                c.execute('''UPDATE downloads 
+                             SET status = ?, title = ?, duration = ?, thumbnail = ?,
+                                 filepath = ?, filesize = ?, error = ?, processed_at = ?
+                             WHERE id = ?''',
+                          (status, title, duration, thumbnail,
+                           result['filepath'], result['filesize'], error, int(time.time()), download_id))
             else:
                 # No downloads to process, sleep for a bit
                 time.sleep(POLL_INTERVAL)
@@ -251,7 +226,7 @@ if __name__ == '__main__':
     os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
     
     # Initialize database if it doesn't exist
-    if not os.path.exists('youtube_downloads.db'):
+    if not os.path.exists(DB_PATH):
         print("❌ Database not found. Please run app.py first to initialize.")
     else:
         print("\n" + "="*60)